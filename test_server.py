@@ -0,0 +1,40 @@
+import os
+import unittest
+
+# server.py exits at import without a key
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import server  # noqa: E402
+
+
+class NormalizeFoodTest(unittest.TestCase):
+    def test_reordered_items_share_a_key(self):
+        for a, b in [
+            ("chicken and rice", "rice with chicken"),
+            ("Toast, 2 eggs", "2 eggs and toast"),
+            ("2 slices of bread", "2 slices bread"),
+            ("  Apple ", "apple"),
+        ]:
+            with self.subTest(a=a, b=b):
+                self.assertEqual(server.normalize_food(a), server.normalize_food(b))
+
+    def test_different_meals_get_different_keys(self):
+        for a, b in [
+            ("3 eggs and 2 slices toast", "2 eggs and 3 slices toast"),
+            ("2 slices bread and 1 slice cheese", "1 slice bread and 2 slices cheese"),
+            ("100 g chicken and 200 g rice", "200 g chicken and 100 g rice"),
+            ("3 large eggs and 2 small apples", "3 large apples and 2 small eggs"),
+            ("chicken fried steak", "steak fried chicken"),
+            ("1/2 cup rice", "2/1 cup rice"),
+            ("🍌", "🍎"),
+            ("a", "the"),
+        ]:
+            with self.subTest(a=a, b=b):
+                self.assertNotEqual(server.normalize_food(a), server.normalize_food(b))
+
+    def test_query_without_words_keys_on_its_text(self):
+        self.assertEqual(server.normalize_food(" 🍌 "), "🍌")
+
+
+if __name__ == "__main__":
+    unittest.main()